@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""Offline benchmarks for the bitcrawl page parsers, using the pages saved in data/test_pages
+
+    Pages can be scaled up synthetically (repeated end to end) to see how
+    parsing time grows with page size.
+
+    Examples:
+    > > python benchmark.py --links --scale 1 10 50
+    > > python benchmark.py --fields
+    > > python benchmark.py --extract --scale 1 100
+
+    :copyright: 2012 by Hobson Lane (hobson@totalgood.com), see AUTHORS for details
+    :license:   Creative Commons BY-NC-SA, see LICENSE for details
+"""
+
+import os
+import time
+import string
+import warnings
+from glob import glob
+from argparse import ArgumentParser
+
+import bitcrawl as bc
+
+TEST_PAGES = 'data/test_pages'
+# the saved test page for each site in bitcrawl.URLs
+SITE_PAGES = {'mtgox': 'mtgox', 'virwox': 'virwox', 'cointron': 'coinotron', 'trade': 'consultancy'}
+
+def load_pages(path=TEST_PAGES):
+    """Read the saved test pages into a {name: html} dict, e.g. {'mtgox': '<html>...'}"""
+    pages = {}
+    for filepath in sorted(glob(os.path.join(path, '*.html'))):
+        with open(filepath) as f:
+            pages[os.path.splitext(os.path.basename(filepath))[0]] = f.read()
+    return pages
+
+def scale_page(page, factor=1):
+    """Synthetically enlarge a page by repeating it `factor` times
+
+    >>> len(scale_page('<html></html>', 3))
+    39
+    """
+    return page * max(int(factor), 1)
+
+def pad_page(page, factor=1):
+    """Synthetically enlarge a page by putting `factor` - 1 copies without any digits in front of it
+
+    Unlike scale_page(), extracted values are then found only at the end, after searching the copies.
+
+    >>> pad_page('<b>12</b>', 3)
+    '<b>xx</b><b>xx</b><b>12</b>'
+    """
+    return page.translate(string.maketrans('0123456789', 'x' * 10)) * (max(int(factor), 1) - 1) + page
+
+def best_time(f, args=(), kwargs=None, repeat=3):
+    """Shortest of `repeat` wall-clock times (in seconds) taken to call f(*args, **kwargs)"""
+    kwargs = kwargs or {}
+    best = float('inf')
+    for i in range(max(int(repeat), 1)):
+        t0 = time.time()
+        f(*args, **kwargs)
+        best = min(best, time.time() - t0)
+    return best
+
+def slicing_get_all_links(page):
+    """The original CS101 link extractor, which copies the rest of the page after every link"""
+    links = []
+    while True:
+        url,endpos = bc.get_next_target(page)
+        if url:
+            links.append(url)
+            page = page[endpos:]
+        else:
+            break
+    return links
+
+def bench_links(pages=None, scales=(1, 10, 50), repeat=3, verbose=True):
+    """Time the original and the single-pass link extractors on each test page at several sizes
+
+    Returns a list of (page name, scale, bytes, links found, slicing seconds, single-pass seconds) rows.
+    """
+    pages = load_pages() if pages is None else pages
+    rows = []
+    if verbose:
+        print '%-12s %6s %10s %7s %12s %12s %8s' % ('page', 'scale', 'bytes', 'links', 'slicing (s)', 'finditer (s)', 'speedup')
+    for name in sorted(pages):
+        for scale in scales:
+            page = scale_page(pages[name], scale)
+            t_old = best_time(slicing_get_all_links, (page,), repeat=repeat)
+            t_new = best_time(bc.get_all_links, (page,), repeat=repeat)
+            row = (name, scale, len(page), len(bc.get_all_links(page)), t_old, t_new)
+            rows.append(row)
+            if verbose:
+                print '%-12s %6d %10d %7d %12.5f %12.5f %7.1fx' % (row + (t_old / max(t_new, 1e-9),))
+    return rows
+
+def per_field_extract(fields, page):
+    """The original extraction, a search of the whole page for each (name, prefix, regex, suffix) field"""
+    values = {}
+    for name, prefix, regex, suffix in fields:
+        mo = bc.compile_pattern(prefix, regex).search(page)
+        if mo and mo.group(mo.lastindex):
+            values[name] = mo.group(mo.lastindex)
+    return values
+
+def table_page(nrows, filler=''):
+    """A synthetic page with `filler` followed by a table of `nrows` labeled values, like the coinotron page
+
+    >>> print table_page(1)
+    <table><tr class="r"><td class="c">COIN0</td><td class="c">1.5 GH</td></tr></table>
+    """
+    rows = ''.join('<tr class="r"><td class="c">COIN%d</td><td class="c">%d.5 GH</td></tr>' % (i, i + 1) for i in range(nrows))
+    return filler + '<table>' + rows + '</table>'
+
+def table_fields(nfields):
+    """coinotron-style fields for the values in a table_page()"""
+    return tuple(('coin%d' % i, r'<tr.*?>\s*<td.*?>\s*COIN%d\s*</td>\s*<td.*?>\s*' % i, r'[0-9]{1,3}[.][0-9]{1,4}\s*[TMG]H', '')
+                 for i in range(nfields))
+
+def bench_fields(pages=None, scales=(1, 10, 50), repeat=3, field_counts=(1, 2, 5, 10, 20, 40), verbose=True):
+    """Time the per-field and single-pass (bitcrawl.Extractor) extraction of each site's fields from its test page
+
+    Then time both on a synthetic table (after 100 kB of filler) with more and more fields to extract.
+    Returns a list of (site, scale, bytes, fields, per-field seconds, single-pass seconds) rows.
+    """
+    pages = load_pages() if pages is None else pages
+    rows = []
+    if verbose:
+        print '%-12s %6s %10s %7s %14s %14s %8s' % ('site', 'scale', 'bytes', 'fields', 'per-field (s)', 'single (s)', 'speedup')
+    def row(site, scale, page, fields):
+        ex = bc.Extractor(fields)
+        assert ex.extract(page) == per_field_extract(fields, page)
+        t_old = best_time(per_field_extract, (fields, page), repeat=repeat)
+        t_new = best_time(ex.extract, (page,), repeat=repeat)
+        rows.append((site, scale, len(page), len(fields), t_old, t_new))
+        if verbose:
+            print '%-12s %6s %10d %7d %14.5f %14.5f %7.1fx' % (rows[-1] + (t_old / max(t_new, 1e-9),))
+    for site, name in sorted(SITE_PAGES.items()):
+        if name not in pages:
+            continue
+        for scale in scales:
+            row(site, scale, scale_page(pages[name], scale), bc.normalize_fields(bc.URLs[site]))
+    page = table_page(max(field_counts), filler='<p>filler</p>' * 8000)
+    for n in field_counts:
+        row('table', '-', page, table_fields(n))
+    return rows
+
+def bench_extract(pages=None, scales=(1, 10, 50), repeat=3, verbose=True):
+    """Time mine_data() on each site's test page with the site's URLs fields, then each field on its own
+
+    Pages are enlarged with pad_page(), so the values are extracted from the end of the page.
+    mine_data() is given a Bot built beforehand, and its warnings about missing fields are
+    ignored, so only the mining of the page is timed.
+
+    Returns a list of (site, field, scale, bytes, seconds, MB/s) rows, where the field is '*' for mine_data().
+    """
+    pages = load_pages() if pages is None else pages
+    rows = []
+    bot = bc.Bot()
+    if verbose:
+        print '%-12s %-16s %6s %10s %12s %9s' % ('site', 'field', 'scale', 'bytes', 'time (s)', 'MB/s')
+    def row(site, field, scale, nbytes, f, *args, **kwargs):
+        t = best_time(f, args, kwargs, repeat=repeat)
+        rows.append((site, field, scale, nbytes, t, nbytes / 1e6 / max(t, 1e-9)))
+        if verbose:
+            print '%-12s %-16s %6d %10d %12.5f %9.1f' % rows[-1]
+    for site, name in sorted(SITE_PAGES.items()):
+        if name not in pages:
+            continue
+        fields = bc.normalize_fields(bc.URLs[site])
+        for scale in scales:
+            page = pad_page(pages[name], scale)
+            assert bc.Extractor(fields).extract(page) == bc.Extractor(fields).extract(pages[name])
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                row(site, '*', scale, len(page), bc.mine_data, bc.URLs[site]['url'], bc.URLs[site], page=page, bot=bot)
+            for field in sorted(fields):
+                row(site, field[0], scale, len(page), bc.Extractor((field,)).extract, page)
+    return rows
+
+def parse_args():
+    p = ArgumentParser(description=__doc__.strip())
+    p.add_argument(
+        '-l','--links',
+        action  = 'store_true',
+        default = False,
+        help    = 'Benchmark link extraction (get_all_links).',
+        )
+    p.add_argument(
+        '-f','--fields',
+        action  = 'store_true',
+        default = False,
+        help    = 'Benchmark extraction of the URLs fields (per-field searches vs the single-pass Extractor).',
+        )
+    p.add_argument(
+        '-e','--extract',
+        action  = 'store_true',
+        default = False,
+        help    = 'Benchmark mine_data() and each field of the URLs sites on their test pages (time and MB/s).',
+        )
+    p.add_argument(
+        '-s','--scale',
+        type    = int,
+        nargs   = '*',
+        default = [1, 10, 50],
+        help    = 'Factors to synthetically enlarge the test pages by.',
+        )
+    p.add_argument(
+        '-r','--repeat',
+        type    = int,
+        default = 3,
+        help    = 'Number of times to repeat each measurement (the fastest is reported).',
+        )
+    p.add_argument(
+        '-p','--path',
+        type    = str,
+        default = TEST_PAGES,
+        help    = 'Directory containing the saved *.html test pages.',
+        )
+    return p.parse_args()
+
+if __name__ == "__main__":
+    o = parse_args()
+    pages = load_pages(o.path)
+    everything = not (o.links or o.fields or o.extract) # run every benchmark unless some are selected
+    if o.links or everything:
+        bench_links(pages, scales=o.scale, repeat=o.repeat)
+    if o.fields or everything:
+        bench_fields(pages, scales=o.scale, repeat=o.repeat)
+    if o.extract or everything:
+        bench_extract(pages, scales=o.scale, repeat=o.repeat)
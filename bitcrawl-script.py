@@ -98,6 +98,44 @@ def parse_args():
         default = '',
         help    = 'Python/Perl regular expression to capture numerical string only.',
         )
+    p.add_argument(
+        '-j','--jobs',
+        type    = int,
+        default = 1,
+        help    = 'Number of pages to fetch and mine concurrently (1 = one site at a time).',
+        )
+    p.add_argument(
+        '-s','--stream',
+        action  = 'store_true',
+        default = False,
+        help    = 'Extract data from pages as they download and stop downloading once all the values are found.',
+        )
+    p.add_argument(
+        '-c','--cache',
+        type    = str,
+        nargs   = '?',
+        const   = bc.CACHE_PATH,
+        default = '',
+        help    = 'Directory for an on-disk cache of the pages retrieved, revalidated with conditional GETs (default path: '+bc.CACHE_PATH+').',
+        )
+    p.add_argument(
+        '--cache-ttl',
+        type    = float,
+        default = bc.CACHE_TTL,
+        help    = 'Seconds a cached page is reused without asking the server whether it has changed.',
+        )
+    p.add_argument(
+        '--replay','--offline',
+        action  = 'store_true',
+        default = False,
+        help    = "Don't use the network, mine the pages stored in the cache instead.",
+        )
+    p.add_argument(
+        '-d','--deadline',
+        type    = float,
+        default = None,
+        help    = 'Seconds the crawl may take, after which remaining pages are skipped rather than retried.',
+        )
     p.add_argument(
         '-v','--verbose',
         action  = 'store_true',
@@ -117,6 +155,13 @@ def parse_args():
         default = False,
         help    = "Don't crawl the internet for numerical data.",
         )
+    p.add_argument(
+        '-t','--trades',
+        type    = str,
+        nargs   = '*',
+        default = [],
+        help    = 'bitcoincharts symbols (e.g. mtgoxUSD) whose new trades are appended to the trade store (bitcrawl.TRADE_STORE).',
+        )
     p.add_argument(
         '-f','--path','--filename',
         type    = str,
@@ -128,10 +173,16 @@ def parse_args():
 
 if __name__ == "__main__":
     o = parse_args()
+    if o.deadline:
+        bc.set_deadline(o.deadline)
+    if o.cache or o.replay:
+        bc.CACHE = bc.ResponseCache(path=o.cache or bc.CACHE_PATH, ttl=o.cache_ttl, replay=o.replay)
 
     data = None
     if not o.quiet or o.verbose:
         data = bc.load_json(filepath=o.path,verbose=-2)
+        # prioritize the sources that have been quick and reliable in the past
+        bc.RESPONSE_STATS.update_from_history(data)
     print o.graph
     sites, values, datetimes = bc.parse_query(o.graph)
     print 'sites',sites
@@ -147,26 +198,21 @@ if __name__ == "__main__":
 
     if not o.nomine:
         # mine hard-coded urls
-        d = dict()
-        if type(o.urls)==dict:
+        if type(o.urls)!=dict:
             # TODO: this check and "iterification" of mine_data() should happen inside the function
-            # check to see if all the dictionary keys look like urls
-            if bc.are_all_urls(o.urls):
-                for u,r in o.urls.items():
-                    d[u]=bc.mine_data(url=u, prefixes=r, verbose=not o.quiet)
-            # otherwise assume the new format where each dict key is a name, and 'url' is a key of the nested dict
-            else:
-                for name,r in o.urls.items():
-                    d[name]=bc.mine_data(url=r.pop('url'), prefixes=r, verbose=not o.quiet)
-        else:
             raise ValueError('Invalid URL, prefix, or regex argument.')
 
         # CRAWLING and MINING done here, data stored as a list of lists of dicts of dicts
-        data=[ d,
-               bc.bitfloor_book       (            verbose=not o.quiet),
-               bc.wikipedia_view_rates(            verbose=not o.quiet),
-               bc.get_links           (max_depth=0,verbose=not o.quiet)
-             ]
+        # with --jobs > 1 all the sources are fetched concurrently
+        data = bc.run_jobs([
+               (bc.mine_all            , dict(urls=o.urls, jobs=o.jobs, stream=o.stream, verbose=not o.quiet)),
+               (bc.bitfloor_book       , dict(             verbose=not o.quiet)),
+               (bc.wikipedia_view_rates, dict(             verbose=not o.quiet)),
+               (bc.get_links           , dict(max_depth=0, verbose=not o.quiet)),
+             ], jobs=o.jobs)
+
+        for symbol in o.trades:
+            bc.fetch_trades(symbol, verbose=not o.quiet)
 
         # compose a json string that can be appended to the end of a list within a json file (prefix = '')
         json_string = bc.join_json(data,prefix='',suffix='\n]\n') 
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""Pull a few fields out of a JSON document a chunk at a time, without decoding (or keeping) the rest
+
+    Selectors are dotted paths like those in api.mtgox.params (e.g. 'return.last.value'), with
+    [i] indexes and (at most one) [start:stop] slice of an array, e.g. 'bids[:10]' for the
+    top of an order book. A selector with a slice selects a list of values.
+
+    Examples:
+    >>> s = Selector({'last': 'return.last.value', 'bids': 'bids[:2]', 'best': 'bids[0][0]'})
+    >>> s.feed('{"return": {"last": {"value": "4.9"}, "high": {"value": "5.1"}}, "bids": [[4.8, 1], [4.7, 2],')
+    False
+    >>> s.feed(' [4.6, 3], [4.5, 4]]}')
+    True
+    >>> sorted(s.values.items())
+    [('best', 4.8), ('bids', [[4.8, 1], [4.7, 2]]), ('last', u'4.9')]
+
+    :copyright: 2012 by Hobson Lane (hobson@totalgood.com), see AUTHORS for details
+    :license:   Creative Commons BY-NC-SA, see LICENSE for details
+"""
+
+import re
+import json
+
+# whitespace, then a punctuation mark, a complete string, or a number or literal
+TOKEN = re.compile(r'\s*(?:([{}\[\]:,])|("(?:[^"\\]|\\.)*")|([-+0-9.eE]+|true|false|null))')
+STRING = r'"(?:[^"\\]|\\.)*"'
+FLAT = r'(?:[^"\[\]{}]|'+STRING+r')*' # the inside of an array or object that doesn't contain any others
+# everything up to the next bracket in a value being skipped or captured, without a Python loop
+# over the strings (which may contain brackets) and flat arrays (like [price, volume] pairs) in it,
+# then the bracket, a lone quote if the rest of a string hasn't arrived yet, or nothing at the end of the text
+BRACKET = re.compile(r'(?:[^"\[\]{}]+|'+STRING+r'|\['+FLAT+r'\]|\{'+FLAT+r'\})*([\[\]{}"]?)')
+STEP = re.compile(r'\.?([^.\[\]]+)|\[(-?[0-9]*)(?:(:)(-?[0-9]*))?\]')
+
+def compile_selector(path):
+    """The steps in a selector path: keys, integer indexes, and a slice
+
+    >>> compile_selector('return.avg.value')
+    ('return', 'avg', 'value')
+    >>> compile_selector('bids[:10][0]')
+    ('bids', slice(0, 10, None), 0)
+    """
+    steps, i = [], 0
+    while i < len(path):
+        mo = STEP.match(path, i)
+        if not mo or mo.end() == i:
+            raise ValueError('Invalid JSON selector '+repr(path)+' at character '+str(i))
+        key, start, colon, stop = mo.groups()
+        if key is not None:
+            steps.append(key)
+        elif colon:
+            steps.append(slice(int(start or 0), int(stop) if stop else None))
+        elif start:
+            steps.append(int(start))
+        else:
+            raise ValueError('Empty index in JSON selector '+repr(path))
+        i = mo.end()
+    if any(isinstance(s, int) and s < 0 or isinstance(s, slice) and (s.start < 0 or (s.stop or 0) < 0) for s in steps):
+        raise ValueError('Negative indexes need the whole array, which a JSON selector never has: '+repr(path))
+    if sum(isinstance(s, slice) for s in steps) > 1:
+        raise ValueError('A JSON selector may only have one slice: '+repr(path))
+    return tuple(steps)
+
+def step_matches(step, key):
+    if isinstance(step, slice):
+        return isinstance(key, int) and step.start <= key and (step.stop is None or key < step.stop)
+    return step == key
+
+def values_at(value, steps):
+    """The list of values at the selector `steps` inside an already decoded JSON `value`
+
+    >>> values_at({'bids': [[4.8, 1], [4.7, 2], [4.6, 3]]}, ('bids', slice(1, None), 0))
+    [4.7, 4.6]
+    """
+    values = [value]
+    for step in steps:
+        inside = []
+        for v in values:
+            if isinstance(step, slice):
+                inside.extend(v[step] if isinstance(v, list) else [])
+            elif isinstance(step, int):
+                inside.extend(v[step:step+1] if isinstance(v, list) else [])
+            elif isinstance(v, dict) and step in v:
+                inside.append(v[step])
+        values = inside
+    return values
+
+def is_sliced(steps):
+    return any(isinstance(s, slice) for s in steps)
+
+class Selector:
+    """Extract the values at a {name: selector path} dict of paths from JSON fed to it in chunks
+
+    feed() returns True once every value has been found, so the rest of the document needn't be read.
+    An empty chunk marks the end of the document. Values that aren't in the document are left
+    out of `values`, except that slices select an empty list.
+    """
+
+    def __init__(self, selectors):
+        self.selectors  = dict((name, compile_selector(path)) for name, path in selectors.items())
+        self.values     = dict((name, []) for name, steps in self.selectors.items() if is_sliced(steps))
+        self.pending    = set(self.selectors)
+        self.buf        = ''
+        self.pos        = 0
+        self.stack      = []    # [container ('{' or '['), key or index, expecting a key] for each open container
+        self.capture    = None  # [names, path, start] while the end of a selected value is found
+        self.depth      = 0     # brackets open in a value being captured or skipped
+        self.rest       = False # whether the rest of the innermost container is being skipped
+        self.bytes_seen = 0
+        self.done       = False
+
+    def path(self):
+        return [c[1] for c in self.stack]
+
+    def wanted(self, path):
+        """(names of the selectors that select the value at `path`, whether a selector selects something inside it)"""
+        names, inside = [], False
+        for name in self.pending:
+            steps = self.selectors[name]
+            if len(steps) >= len(path) and all(step_matches(s, k) for s, k in zip(steps, path)):
+                if len(steps) == len(path):
+                    names.append(name)
+                else:
+                    inside = True
+        return names, inside
+
+    def inside(self, path):
+        """Names of the pending selectors of something inside the value at `path`"""
+        return [name for name in self.pending if len(self.selectors[name]) > len(path) and
+                all(step_matches(s, k) for s, k in zip(self.selectors[name], path))]
+
+    def closed(self, path, value=None):
+        """The container at `path` has ended (and been decoded as `value` if it was captured)"""
+        for name in self.inside(path):
+            steps = self.selectors[name]
+            if value is not None:
+                self.found([name], values_at(value, steps[len(path):]))
+            # other elements of a slice may be in later containers, unless the slice is inside this one
+            if not is_sliced(steps[:len(path)]):
+                self.pending.discard(name)
+
+    def found(self, names, values):
+        """Record the `values` selected by the selectors `names`"""
+        for name in names:
+            if is_sliced(self.selectors[name]):
+                self.values[name].extend(values)
+            elif values:
+                self.values[name] = values[0]
+                self.pending.discard(name)
+
+    def passed(self, path):
+        """An array element at `path` is being started, so slices that end before it are done"""
+        for name in list(self.pending):
+            steps = self.selectors[name]
+            n = len(path)
+            if (len(steps) >= n and isinstance(steps[n-1], slice) and steps[n-1].stop is not None
+                    and path[-1] >= steps[n-1].stop and all(step_matches(s, k) for s, k in zip(steps[:n-1], path[:-1]))):
+                self.pending.discard(name)
+
+    def scan(self, final):
+        """Find the end of the value being captured or skipped, returning False if more of the document is needed"""
+        while self.depth:
+            mo = BRACKET.match(self.buf, self.pos)
+            c = mo.group(1)
+            if not c or c == '"':
+                self.pos = mo.start(1)
+                if final:
+                    raise ValueError('Unexpected end of the JSON document')
+                return False
+            self.depth += 1 if c in '[{' else -1
+            self.pos = mo.end()
+        if self.capture:
+            names, path, start = self.capture
+            self.capture = None
+            value = json.loads(self.buf[start:self.pos])
+            self.found(names, [value])
+            self.closed(path, value)
+        if self.rest:
+            self.rest = False
+            self.stack.pop()
+            self.closed(self.path())
+        self.end_value()
+        return True
+
+    def end_value(self):
+        if self.stack and self.stack[-1][0] == '{':
+            self.stack[-1][2] = True # the next string is a key
+
+    def feed(self, chunk):
+        if self.done:
+            return True
+        final = not chunk
+        self.bytes_seen += len(chunk)
+        # forget what's been parsed, except for a value that's still being captured
+        keep = self.capture[2] if self.capture else self.pos
+        if self.capture:
+            self.capture[2] = 0
+        self.buf, self.pos = self.buf[keep:] + chunk, self.pos - keep
+        if self.depth and not self.scan(final):
+            return False
+        while self.pending:
+            mo = TOKEN.match(self.buf, self.pos)
+            if not mo or (mo.group(3) and mo.end() == len(self.buf) and not final):
+                if final and self.buf[self.pos:].strip():
+                    raise ValueError('Invalid JSON at '+repr(self.buf[self.pos:self.pos+40]))
+                break # a token may be split between chunks
+            punct, string, literal = mo.groups()
+            if punct in (':', ','):
+                if punct == ',' and self.stack and self.stack[-1][0] == '[':
+                    self.stack[-1][1] += 1
+                self.pos = mo.end()
+                continue
+            if punct in (']', '}'):
+                self.pos = mo.end()
+                self.stack.pop()
+                self.closed(self.path())
+                self.end_value()
+                continue
+            if string and self.stack and self.stack[-1][0] == '{' and self.stack[-1][2]:
+                self.stack[-1][1] = json.loads(string) # a key
+                self.stack[-1][2] = False
+                self.pos = mo.end()
+                continue
+            # the start of a value
+            path = self.path()
+            if self.stack and not self.inside(path[:-1]):
+                # nothing else is wanted from this container (e.g. the rest of a long order book)
+                self.depth, self.rest = 1, True
+                if not self.scan(final):
+                    break
+                continue
+            if self.stack and self.stack[-1][0] == '[':
+                self.passed(path)
+            names, inside = self.wanted(path)
+            if punct and names:
+                # the whole value is decoded, along with anything else selected inside it
+                self.capture, self.depth, self.pos = [names, path, mo.start(1)], 1, mo.end()
+                if not self.scan(final):
+                    break
+            elif punct and inside:
+                self.stack.append([punct, 0 if punct == '[' else None, punct == '{'])
+                self.pos = mo.end()
+            elif punct:
+                self.depth, self.pos = 1, mo.end() # skip the whole container
+                if not self.scan(final):
+                    break
+            else:
+                if names:
+                    self.found(names, [json.loads(string or literal)])
+                self.pos = mo.end()
+                self.end_value()
+        self.done = not self.pending or final
+        return self.done
+
+def select(text, selectors):
+    """{name: value} for each of a {name: selector path} dict of `selectors` found in a JSON string
+
+    >>> select('{"seq": 7, "bids": [[4.8, 1]]}', {'top': 'bids[0][0]', 'seq': 'seq', 'ask': 'asks[0][0]'})
+    {'top': 4.8, 'seq': 7}
+    """
+    s = Selector(selectors)
+    s.feed(text) or s.feed('')
+    return s.values
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""Compact store for the link graph discovered by a crawl (see bitcrawl.get_links), with PageRank
+
+    Each URL is interned to an integer id, and the links between pages are kept as two
+    arrays of ids until they're packed into CSR (compressed sparse row) arrays:
+    `indptr` (the offsets of each page's links) and `indices` (the ids of the pages linked to).
+
+    Examples:
+    >>> g = LinkGraph()
+    >>> g.add_links('http://a.com/', ['http://b.com/', 'http://c.com/'])
+    >>> g.add_links('http://b.com/', ['http://c.com/'])
+    >>> g.add_links('http://c.com/', ['http://a.com/'])
+    >>> g.in_degree().tolist(), g.out_degree().tolist()
+    ([1, 1, 2], [2, 1, 1])
+    >>> [url for url, score in g.top(g.pagerank(), 2)]
+    ['http://c.com/', 'http://a.com/']
+
+    :copyright: 2012 by Hobson Lane (hobson@totalgood.com), see AUTHORS for details
+    :license:   Creative Commons BY-NC-SA, see LICENSE for details
+"""
+
+import os
+from array import array
+import urlparse
+
+import numpy as np
+
+PAGERANK_DAMPING = 0.85 # probability that a random surfer follows a link rather than jumping to a random page
+PAGERANK_TOL = 1e-9     # stop iterating once the ranks change by less than this (L1 norm)
+PAGERANK_MAX_ITER = 100
+
+class LinkGraph:
+    """URLs interned to integer ids, and the links between them, stored as CSR arrays once packed"""
+
+    def __init__(self):
+        self.ids  = {}           # url -> id
+        self.urls = []           # id -> url
+        self.src  = array('i')   # ids of the pages linking, not yet packed
+        self.dst  = array('i')   # ids of the pages linked to, not yet packed
+        self.indptr  = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+
+    def intern(self, url):
+        """The integer id of `url`, assigning the next one if it's new"""
+        i = self.ids.get(url)
+        if i is None:
+            i = self.ids[url] = len(self.urls)
+            self.urls.append(url)
+        return i
+
+    def add_links(self, url, link_urls):
+        """Record the links from the page at `url` to each of `link_urls` (links to itself are ignored)"""
+        i = self.intern(url)
+        for u in link_urls:
+            j = self.intern(u)
+            if j != i:
+                self.src.append(i)
+                self.dst.append(j)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def csr(self):
+        """(indptr, indices) arrays with the links from page id i in indices[indptr[i]:indptr[i+1]]
+
+        Duplicate links are counted once and each page's links are sorted by id.
+        """
+        n = len(self.urls)
+        if len(self.src) or len(self.indptr) != n + 1:
+            src = np.concatenate([np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr)),
+                                  np.frombuffer(self.src, dtype=np.int32)])
+            dst = np.concatenate([self.indices, np.frombuffer(self.dst, dtype=np.int32)])
+            keys = np.unique(src.astype(np.int64) * n + dst)
+            self.indptr = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(keys // n, minlength=n), out=self.indptr[1:])
+            self.indices = (keys % n).astype(np.int32)
+            self.src, self.dst = array('i'), array('i')
+        return self.indptr, self.indices
+
+    def out_degree(self):
+        """Number of (distinct) pages each page links to, indexed by id"""
+        return np.diff(self.csr()[0])
+
+    def in_degree(self):
+        """Number of (distinct) pages linking to each page, indexed by id"""
+        return np.bincount(self.csr()[1], minlength=len(self.urls))
+
+    def pagerank(self, damping=PAGERANK_DAMPING, tol=PAGERANK_TOL, max_iter=PAGERANK_MAX_ITER):
+        """PageRank of each page, indexed by id, by power iteration (the ranks sum to 1)
+
+        The rank of pages without any links (including pages that weren't crawled) is spread evenly over all pages.
+        """
+        indptr, indices = self.csr()
+        n = len(self.urls)
+        if not n:
+            return np.zeros(0)
+        out = np.diff(indptr)
+        src = np.repeat(np.arange(n), out)
+        dangling = out == 0
+        rank = np.ones(n) / n
+        for i in range(max_iter):
+            share = rank / np.maximum(out, 1)
+            new = np.bincount(indices, weights=share[src], minlength=n)
+            new = damping * (new + rank[dangling].sum() / n) + (1. - damping) / n
+            done = np.abs(new - rank).sum() < tol
+            rank = new
+            if done:
+                break
+        return rank
+
+    def top(self, scores, n=10):
+        """The `n` (url, score) pairs with the highest `scores` (e.g. from pagerank() or in_degree())"""
+        order = np.argsort(-np.asarray(scores), kind='mergesort')[:n]
+        return [(self.urls[i], scores[i]) for i in order]
+
+    def host_scores(self, scores):
+        """Total of the `scores` for the pages on each host, as a {host: score} dict
+
+        >>> g = LinkGraph()
+        >>> g.add_links('http://a.com/1', ['http://b.com/', 'http://b.com/x'])
+        >>> g.host_scores(g.in_degree())
+        {'a.com': 0, 'b.com': 2}
+        """
+        totals = {}
+        for url, score in zip(self.urls, np.asarray(scores).tolist()):
+            host = urlparse.urlsplit(url).netloc.lower()
+            totals[host] = totals.get(host, 0) + score
+        return totals
+
+    def save(self, path):
+        """Write the URLs (UTF-8 encoded) and CSR arrays to a compressed numpy .npz file (via a temporary file, then renamed)
+
+        >>> import tempfile, shutil
+        >>> tmp = tempfile.mkdtemp()
+        >>> g = LinkGraph()
+        >>> g.add_links(u'http://a.com/caf\\xe9', ['http://b.com/'])
+        >>> g.save(os.path.join(tmp, 'links.npz'))
+        >>> LinkGraph.load(os.path.join(tmp, 'links.npz')).urls
+        [u'http://a.com/caf\\xe9', u'http://b.com/']
+        >>> shutil.rmtree(tmp)
+        """
+        indptr, indices = self.csr()
+        urls = '\n'.join(u.encode('utf-8') if isinstance(u, unicode) else u for u in self.urls)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, indptr=indptr, indices=indices, urls=np.frombuffer(urls, dtype=np.uint8))
+        os.rename(tmp, path)
+
+    def read(self, path):
+        """Replace the contents of this graph with those saved by save(), returning self"""
+        f = np.load(path)
+        self.urls = f['urls'].tostring().decode('utf-8').split(u'\n') if len(f['urls']) else []
+        self.ids  = dict((u, i) for i, u in enumerate(self.urls))
+        self.indptr, self.indices = f['indptr'], f['indices']
+        self.src, self.dst = array('i'), array('i')
+        f.close()
+        return self
+
+    @classmethod
+    def load(cls, path):
+        """Read a LinkGraph written by save(), which may then have more links added"""
+        return cls().read(path)
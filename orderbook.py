@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""Compact, append-only store of order book snapshots (e.g. from bitcrawl.bitfloor_book)
+
+    Prices and sizes are kept as fixed-point int64 (in units of 1e-8, like the bitfloor API's
+    8 decimal places). Each snapshot is stored as the levels that changed since the one before it
+    (with a size of 0 for levels that were removed), except for a full "keyframe" snapshot every
+    `keyframe_every` snapshots. An index of the time, file offset and best bid and ask of every
+    snapshot is kept alongside, so any snapshot can be rebuilt from the nearest keyframe before it,
+    and the best bid/ask series can be read without decoding any snapshots at all.
+
+    Examples:
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp()
+    >>> store = BookStore(os.path.join(tmp, 'book'), keyframe_every=2)
+    >>> store.append(734605.5, bids=[['4.88', '0.5'], ['4.87', '0.75']], asks=[['4.90', '27.571']])
+    >>> store.append(734605.6, bids=[['4.88', '1.5'], ['4.87', '0.75']], asks=[['4.91', '2']])
+    >>> t, bids, asks = BookStore(store.path).snapshot(1)
+    >>> bids.tolist(), asks.tolist()
+    ([[4.88, 1.5], [4.87, 0.75]], [[4.91, 2.0]])
+    >>> [a.tolist() for a in store.best()]
+    [[734605.5, 734605.6], [4.88, 4.88], [4.9, 4.91]]
+
+    A record left incomplete by an interrupted append is ignored, then overwritten by the next one:
+
+    >>> with open(store.path + '.idx', 'ab') as f:
+    ...     f.write('torn')
+    >>> store = BookStore(store.path, keyframe_every=2)
+    >>> store.append(734605.7, bids=[['4.89', '1']], asks=[['4.91', '2']])
+    >>> BookStore(store.path).times().tolist()
+    [734605.5, 734605.6, 734605.7]
+    >>> shutil.rmtree(tmp)
+
+    :copyright: 2012 by Hobson Lane (hobson@totalgood.com), see AUTHORS for details
+    :license:   Creative Commons BY-NC-SA, see LICENSE for details
+"""
+
+import os
+
+import numpy as np
+
+SCALE = 10 ** 8 # fixed-point units per unit of price or size
+KEYFRAME_EVERY = 100 # snapshots between full snapshots, the most that must be applied to rebuild one
+# one record per snapshot: its time, where its levels start in the data file, how many bid and ask
+# levels were stored, whether they're the whole book, and the best bid and ask (0 if there weren't any)
+INDEX_DTYPE = np.dtype([('time', '<f8'), ('offset', '<i8'), ('bids', '<i4'), ('asks', '<i4'),
+                        ('keyframe', '?'), ('bid', '<i8'), ('ask', '<i8')])
+
+def fixed_point(levels):
+    """An int64 array of (price, size) rows from a list of [price, size, ...] levels (numbers or strings)
+
+    >>> fixed_point([['4.88000000', '0.50000000', 3]]).tolist()
+    [[488000000, 50000000]]
+    """
+    levels = [l[:2] for l in levels]
+    return np.rint(np.array(levels, dtype=float).reshape(-1, 2) * SCALE).astype(np.int64)
+
+def sort_levels(levels, side):
+    """The (price, size) rows with one per price (sizes summed) and no empty levels, best price first"""
+    prices, where = np.unique(levels[:, 0], return_inverse=True)
+    sizes = np.zeros(len(prices), dtype=np.int64)
+    np.add.at(sizes, where, levels[:, 1])
+    book = np.column_stack([prices, sizes])[sizes != 0]
+    return book[::-1] if side == 'bids' else book
+
+def diff_levels(old, new):
+    """The levels in the `new` book whose size differs from the `old` one, with a size of 0 for removed ones"""
+    order = np.argsort(old[:, 0])
+    prices, sizes = old[order, 0], old[order, 1]
+    i = np.minimum(np.searchsorted(prices, new[:, 0]), max(len(prices) - 1, 0))
+    same = (prices[i] == new[:, 0]) & (sizes[i] == new[:, 1]) if len(prices) else np.zeros(len(new), bool)
+    removed = old[~np.in1d(old[:, 0], new[:, 0]), 0]
+    return np.vstack([new[~same], np.column_stack([removed, np.zeros_like(removed)])])
+
+def apply_levels(book, changes, side):
+    """The `book` after replacing the sizes of the levels in `changes` (see diff_levels())"""
+    kept = book[~np.in1d(book[:, 0], changes[:, 0])]
+    return sort_levels(np.vstack([kept, changes]), side)
+
+class BookStore:
+    """Order book snapshots appended to the data file `path` and its index file `path`.idx"""
+
+    def __init__(self, path, keyframe_every=KEYFRAME_EVERY):
+        self.path = path
+        self.keyframe_every = keyframe_every
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        if os.path.isfile(path + '.idx'):
+            with open(path + '.idx', 'rb') as f:
+                data = f.read()
+            # ignoring any record left incomplete by an interrupted append
+            self.index = np.frombuffer(data[:len(data) // INDEX_DTYPE.itemsize * INDEX_DTYPE.itemsize], dtype=INDEX_DTYPE).copy()
+        self.last = None # the fixed-point (bids, asks) of the latest snapshot, once it's needed
+
+    def __len__(self):
+        return len(self.index)
+
+    def times(self):
+        return self.index['time']
+
+    def read(self, f, i):
+        """The fixed-point (bids, asks) levels stored for snapshot `i` in the open data file `f`"""
+        rec = self.index[i]
+        f.seek(int(rec['offset']))
+        levels = np.fromfile(f, dtype='<i8', count=2 * (int(rec['bids']) + int(rec['asks']))).reshape(-1, 2)
+        return levels[:rec['bids']], levels[rec['bids']:]
+
+    def book(self, i):
+        """The fixed-point (bids, asks) of snapshot `i`, rebuilt from the keyframe before it"""
+        i = range(len(self))[i]
+        keyframe = np.flatnonzero(self.index['keyframe'][:i+1])[-1]
+        with open(self.path, 'rb') as f:
+            bids, asks = self.read(f, keyframe)
+            for j in range(keyframe + 1, i + 1):
+                changed_bids, changed_asks = self.read(f, j)
+                bids, asks = apply_levels(bids, changed_bids, 'bids'), apply_levels(asks, changed_asks, 'asks')
+        return bids, asks
+
+    def snapshot(self, i):
+        """(time, bids, asks) of snapshot `i`, with (price, size) float rows, best price first"""
+        bids, asks = self.book(i)
+        return self.index['time'][i], bids / float(SCALE), asks / float(SCALE)
+
+    def best(self):
+        """(times, best bids, best asks) arrays for every snapshot, NaN where a side of the book was empty"""
+        bid, ask = [np.where(self.index[side] != 0, self.index[side] / float(SCALE), np.nan) for side in ('bid', 'ask')]
+        return self.index['time'], bid, ask
+
+    def append(self, t, bids, asks):
+        """Store a snapshot taken at time `t` (e.g. a bitcrawl.datetime2float()) of the [price, size] `bids` and `asks`"""
+        bids, asks = sort_levels(fixed_point(bids), 'bids'), sort_levels(fixed_point(asks), 'asks')
+        keyframe = not len(self) % self.keyframe_every
+        if keyframe:
+            stored = bids, asks
+        else:
+            if self.last is None:
+                self.last = self.book(-1)
+            stored = diff_levels(self.last[0], bids), diff_levels(self.last[1], asks)
+        self.last = bids, asks
+        if os.path.dirname(self.path) and not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'ab') as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(np.vstack(stored).astype('<i8').tobytes())
+        rec = np.array([(t, offset, len(stored[0]), len(stored[1]), keyframe,
+                         bids[0, 0] if len(bids) else 0, asks[0, 0] if len(asks) else 0)], dtype=INDEX_DTYPE)
+        # the index is written after the levels, so an interrupted append leaves the store readable
+        with open(self.path + '.idx', 'ab') as f:
+            # drop any incomplete record after the last complete one, so this one isn't misaligned
+            f.seek(0, os.SEEK_END)
+            if f.tell() != len(self) * INDEX_DTYPE.itemsize:
+                f.truncate(len(self) * INDEX_DTYPE.itemsize)
+            f.write(rec.tobytes())
+        self.index = np.concatenate([self.index, rec])
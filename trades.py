@@ -0,0 +1,434 @@
+#!/usr/bin/env python
+"""Columnar store of the trades of each symbol, from bitcoincharts' trades.csv (see bitcrawl.fetch_trades) or trade feed
+
+    Each symbol's trades are kept in three append-only files of little-endian int64: the
+    unixtime, and the price and amount in fixed point (see orderbook.SCALE). Trades are
+    appended a batch at a time, and read by time range, without loading the rest of the history.
+
+    Examples:
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp()
+    >>> store = TradeStore(tmp)
+    >>> ingester = TradeIngester(store, 'mtgoxUSD')
+    >>> ingester.feed('1303000000,4.94,0.01\\n1303000060,4.95,2.5\\n13030')
+    False
+    >>> ingester.feed('00060,4.96,1\\n')
+    False
+    >>> ingester.feed('')
+    True
+    >>> [a.tolist() for a in store.read('mtgoxUSD', start=1303000060)]
+    [[1303000060, 1303000060], [4.95, 4.96], [2.5, 1.0]]
+    >>> TradeIngester(store, 'mtgoxUSD').ingest(['1303000060,4.95,2.5\\n1303000060,4.96,1\\n1303000120,5,3\\n'])
+    1
+    >>> store.count('mtgoxUSD'), store.last('mtgoxUSD')
+    (4, (1303000120, 1))
+
+    A TradeFeed keeps a socket open to a trade feed, storing the trades as they arrive, and
+    reconnects whenever the connection is lost. Here a stand-in for the feed sends one trade
+    and hangs up, so the feed reconnects and receives the trade again, but only stores it once:
+
+    >>> import SocketServer, threading
+    >>> class StandIn(SocketServer.BaseRequestHandler):
+    ...     def handle(self):
+    ...         self.request.sendall('{"symbol": "btcexYAD", "timestamp": 1303000000, "price": 4.9, "volume": 1.5}\\n')
+    >>> server = SocketServer.TCPServer(('localhost', 0), StandIn)
+    >>> threading.Thread(target=server.serve_forever).start()
+    >>> feed = TradeFeed(store, *server.server_address, reconnect_delay=0.01)
+    >>> feed.run(seconds=0.5)
+    1
+    >>> feed.connects > 1, store.read('btcexYAD')[2].tolist()
+    (True, [1.5])
+    >>> server.shutdown()
+    >>> shutil.rmtree(tmp)
+
+    :copyright: 2012 by Hobson Lane (hobson@totalgood.com), see AUTHORS for details
+    :license:   Creative Commons BY-NC-SA, see LICENSE for details
+"""
+
+import os
+import time
+import json
+import random
+import socket
+from warnings import warn
+from argparse import ArgumentParser
+
+import numpy as np
+
+from orderbook import SCALE
+
+COLUMNS = ('price', 'amount', 'time') # the time column is written last, so its length is the number of trades stored
+FLUSH_ROWS = 50000 # trades a TradeIngester holds in memory before appending them to the store
+FEED_HOST = 'bitcoincharts.com' # the experimental telnet interface that streams trades as they happen
+FEED_PORT = 27007
+FLUSH_SECONDS = 10 # longest a TradeFeed holds trades in memory before appending them to the store
+FEED_TIMEOUT = 300 # seconds a TradeFeed waits for data before reconnecting
+RECONNECT_DELAY = 1 # seconds before a TradeFeed's first reconnection attempt, doubled for each failed one after it
+MAX_RECONNECT_DELAY = 600
+MAX_LINE = 65536 # characters of a TradeFeed line without an end, after which it's discarded
+
+def three_fields(lines, nlines):
+    """Whether each of the `nlines` newline-separated `lines` has exactly two commas"""
+    chars = np.frombuffer(lines, dtype=np.uint8)
+    separators = chars[(chars == ord(',')) | (chars == ord('\n'))]
+    # ",,\n" for every line, except that the last one doesn't end with a newline
+    return np.array_equal(separators, np.tile(np.frombuffer(',,\n', dtype=np.uint8), nlines)[:-1])
+
+def parse_csv(text):
+    """(times, prices, amounts, bad lines) from complete lines of "unixtime,price,amount" CSV
+
+    Prices and amounts are in fixed point. Lines that aren't three numbers are skipped.
+
+    >>> [a.tolist() for a in parse_csv('1303000000,4.94,0.01\\nunixtime,price,amount\\n')[:3]]
+    [[1303000000], [494000000], [1000000]]
+    >>> times, prices, amounts, bad = parse_csv('1303000000,4.94\\n1303000060,4.95,2.5,7\\n1303000120,5,3\\n')
+    >>> times.tolist(), amounts.tolist(), bad
+    ([1303000120], [300000000], 2)
+    """
+    lines = text.replace('\r', '').strip('\n')
+    nlines = lines.count('\n') + 1 if lines else 0
+    # numpy's C parser reads well-formed CSV much faster than splitting each line
+    values = np.fromstring(lines.replace('\n', ','), sep=',') if lines else np.zeros(0)
+    bad = 0
+    if len(values) != 3 * nlines or not three_fields(lines, nlines):
+        rows = []
+        for line in lines.split('\n'):
+            try:
+                row = [float(x) for x in line.split(',')]
+            except ValueError:
+                row = []
+            if len(row) == 3:
+                rows.append(row)
+            elif line.strip():
+                bad += 1
+        values = np.array(rows, dtype=float)
+    values = values.reshape(-1, 3)
+    return (values[:, 0].astype(np.int64), np.rint(values[:, 1] * SCALE).astype(np.int64),
+            np.rint(values[:, 2] * SCALE).astype(np.int64), bad)
+
+class TradeStore:
+    """The trades of each symbol, in a directory of append-only int64 column files (`path`/symbol.column)"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def filename(self, symbol, column):
+        return os.path.join(self.path, symbol + '.' + column)
+
+    def symbols(self):
+        return sorted(f[:-5] for f in os.listdir(self.path) if f.endswith('.time')) if os.path.isdir(self.path) else []
+
+    def count(self, symbol):
+        """Number of trades stored for `symbol`"""
+        filename = self.filename(symbol, 'time')
+        return os.path.getsize(filename) // 8 if os.path.isfile(filename) else 0
+
+    def last(self, symbol):
+        """(unixtime of the latest trade stored for `symbol`, how many trades were at that time), or (None, 0)"""
+        n = self.count(symbol)
+        if not n:
+            return None, 0
+        times = np.memmap(self.filename(symbol, 'time'), dtype='<i8', mode='r', shape=(n,))
+        # the trades at the latest time are at the end, so only a tail long enough to hold them is read
+        tail = 1024
+        while True:
+            same = np.count_nonzero(times[-tail:] == times[-1])
+            if same < min(tail, n):
+                return int(times[-1]), same
+            if tail >= n:
+                return int(times[-1]), n
+            tail *= 2
+
+    def append(self, symbol, times, prices, amounts):
+        """Append int64 arrays of `times`, fixed-point `prices` and `amounts` to the trades of `symbol`"""
+        if not len(times):
+            return
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        n = self.count(symbol)
+        for column, values in zip(COLUMNS, (prices, amounts, times)):
+            with open(self.filename(symbol, column), 'ab') as f:
+                # drop anything left after the last complete trade by an interrupted append
+                f.seek(0, os.SEEK_END)
+                if f.tell() != 8 * n:
+                    f.truncate(8 * n)
+                f.write(np.asarray(values, dtype='<i8').tobytes())
+
+    def read(self, symbol, start=None, end=None):
+        """(unixtimes, prices, amounts) of the trades of `symbol` from time `start` up to (not including) `end`"""
+        n = self.count(symbol)
+        if not n:
+            return np.zeros(0, np.int64), np.zeros(0), np.zeros(0)
+        columns = dict((c, np.memmap(self.filename(symbol, c), dtype='<i8', mode='r', shape=(n,))) for c in COLUMNS)
+        i = 0 if start is None else np.searchsorted(columns['time'], start)
+        j = n if end is None else np.searchsorted(columns['time'], end)
+        return (np.array(columns['time'][i:j]), columns['price'][i:j] / float(SCALE),
+                columns['amount'][i:j] / float(SCALE))
+
+class TradeIngester:
+    """Parse trades.csv text, fed a chunk at a time, into a TradeStore, `flush_rows` trades at a time
+
+    Trades from before the latest one already stored or buffered (as in a download that
+    overlaps the last one) are skipped, so a trade is never stored twice (see add()). An empty chunk
+    marks the end of the text, and feed() only returns True then, like StreamExtractor.feed().
+    """
+
+    def __init__(self, store, symbol, flush_rows=FLUSH_ROWS):
+        self.store      = store
+        self.symbol     = symbol
+        self.flush_rows = flush_rows
+        self.latest, self.at_latest = store.last(symbol) # the newest trade's time, and the number at that time
+        self.seen       = 0  # trades at the `latest` time seen in the text so far
+        self.partial    = '' # an incomplete last line
+        self.batches    = []
+        self.buffered   = 0
+        self.stored     = 0
+        self.bad        = 0
+        self.late       = 0
+        self.duplicates = 0
+
+    def feed(self, chunk):
+        final = not chunk
+        text = self.partial + chunk
+        end = len(text) if final else text.rfind('\n') + 1
+        self.partial = text[end:]
+        times, prices, amounts, bad = parse_csv(text[:end])
+        self.bad += bad
+        self.add(times, prices, amounts)
+        if final:
+            self.flush()
+        return final
+
+    def add(self, times, prices, amounts):
+        """Buffer the trades in int64 arrays of `times` and fixed-point `prices` and `amounts` that aren't stored yet
+
+        Trades older than one before them (or than the latest stored) are counted in `late` and
+        skipped, since the store is kept in time order, and repeats of stored ones in `duplicates`.
+
+        >>> ingester = TradeIngester(TradeStore('nowhere'), 'mtgoxUSD')
+        >>> ingester.add(np.array([5, 7, 6, 7]), np.ones(4, np.int64), np.ones(4, np.int64))
+        >>> ingester.buffered, ingester.late
+        (3, 1)
+        """
+        if len(times):
+            # the latest time before each trade
+            before = np.maximum.accumulate(np.concatenate([times[:1] if self.latest is None else [self.latest], times]))[:-1]
+            keep = times >= before
+            self.late += len(times) - np.count_nonzero(keep)
+            if self.latest is not None:
+                same = np.flatnonzero(times == self.latest)
+                # trades at the latest time beyond the number already stored are new
+                repeated = same[:max(self.at_latest - self.seen, 0)]
+                keep[repeated] = False
+                self.duplicates += len(repeated)
+                self.seen += len(same)
+            times, prices, amounts = times[keep], prices[keep], amounts[keep]
+        if len(times):
+            n = np.count_nonzero(times == times[-1])
+            if times[-1] != self.latest:
+                self.latest, self.at_latest, self.seen = times[-1], n, n
+            else:
+                self.at_latest += n
+            self.batches.append((times, prices, amounts))
+            self.buffered += len(times)
+        if self.buffered >= self.flush_rows:
+            self.flush()
+
+    def restart(self):
+        """The text starts over (e.g. a feed reconnected), so trades at the latest time may be repeated in it"""
+        self.seen = 0
+
+    def flush(self):
+        """Append the buffered trades to the store"""
+        if self.batches:
+            self.store.append(self.symbol, *[np.concatenate(column) for column in zip(*self.batches)])
+            self.stored += self.buffered
+        self.batches, self.buffered = [], 0
+
+    def ingest(self, chunks):
+        """Feed each of an iterable of chunks (e.g. a file), then the end, returning the number of trades stored"""
+        for chunk in chunks:
+            if chunk:
+                self.feed(chunk)
+        self.feed('')
+        return self.stored
+
+def parse_feed_line(line):
+    """(symbol, unixtime, price, amount) from a line of the trade feed, a JSON object, or None if it isn't a trade
+
+    >>> parse_feed_line('{"volume": 0.5, "timestamp": 1303000000, "price": 4.94, "symbol": "mtgoxUSD", "id": 7}')
+    (u'mtgoxUSD', 1303000000, 4.94, 0.5)
+    """
+    try:
+        # ignoring any telnet negotiation in front of it
+        trade = json.loads(line[line.index('{'):])
+        return trade['symbol'], int(trade['timestamp']), float(trade['price']), float(trade.get('volume', trade.get('amount')))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+class TradeFeed:
+    """Append the trades streamed by a TCP trade feed (a JSON object per line) to a TradeStore
+
+    At most `flush_rows` trades are held in memory, for at most `flush_seconds`. Only the trades
+    of `symbols` are kept, if given. Trades already stored (e.g. repeated after a reconnection)
+    and trades that arrive after a later one are skipped, like a TradeIngester's, and counted
+    by duplicates() and late(). See the trades module doctests.
+    """
+
+    def __init__(self, store, host=FEED_HOST, port=FEED_PORT, symbols=None, flush_rows=FLUSH_ROWS,
+                 flush_seconds=FLUSH_SECONDS, timeout=FEED_TIMEOUT, reconnect_delay=RECONNECT_DELAY):
+        self.store           = store
+        self.address         = (host, port)
+        self.symbols         = set(symbols) if symbols else None
+        self.flush_rows      = flush_rows
+        self.flush_seconds   = flush_seconds
+        self.timeout         = timeout
+        self.reconnect_delay = reconnect_delay
+        self.ingesters       = {} # a TradeIngester for each symbol, which skips trades already stored
+        self.partial         = ''
+        self.flushed         = time.time()
+        self.connects        = 0
+        self.received        = 0
+        self.bad             = 0
+
+    def ingester(self, symbol):
+        if symbol not in self.ingesters:
+            # the TradeFeed flushes every symbol at once, so its ingesters never do
+            self.ingesters[symbol] = TradeIngester(self.store, symbol, flush_rows=float('inf'))
+        return self.ingesters[symbol]
+
+    def buffered(self):
+        return sum(i.buffered for i in self.ingesters.values())
+
+    def stored(self):
+        return sum(i.stored for i in self.ingesters.values())
+
+    def late(self):
+        """Number of trades skipped because they arrived after a later one (see TradeIngester.add())"""
+        return sum(i.late for i in self.ingesters.values())
+
+    def duplicates(self):
+        return sum(i.duplicates for i in self.ingesters.values())
+
+    def feed(self, chunk):
+        """Parse and buffer the complete lines in a chunk of the feed, then flush them if enough have accumulated"""
+        lines = (self.partial + chunk).split('\n')
+        self.partial = lines.pop()
+        if len(self.partial) > MAX_LINE:
+            self.partial = ''
+            self.bad += 1
+        trades = {}
+        for line in lines:
+            trade = parse_feed_line(line)
+            if trade is None:
+                self.bad += bool(line.strip())
+            elif self.symbols is None or trade[0] in self.symbols:
+                trades.setdefault(trade[0], []).append(trade[1:])
+        for symbol, rows in trades.items():
+            self.received += len(rows)
+            rows = np.array(rows)
+            self.ingester(symbol).add(rows[:, 0].astype(np.int64), np.rint(rows[:, 1] * SCALE).astype(np.int64),
+                                      np.rint(rows[:, 2] * SCALE).astype(np.int64))
+        if self.buffered() >= self.flush_rows or time.time() - self.flushed >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered trades of every symbol to the store"""
+        for ingester in self.ingesters.values():
+            ingester.flush()
+        self.flushed = time.time()
+
+    def run(self, seconds=None, stop=None):
+        """Read the feed until `seconds` have passed or `stop` (a threading.Event) is set, returning the number of trades stored
+
+        Whenever the connection fails, closes or goes quiet for `timeout` seconds, the feed is reconnected
+        after a delay that doubles (up to MAX_RECONNECT_DELAY) until some data arrives again.
+        """
+        deadline = None if seconds is None else time.time() + seconds
+        left = lambda: float('inf') if deadline is None else deadline - time.time()
+        stopped = lambda: left() <= 0 or (stop is not None and stop.is_set())
+        delay = self.reconnect_delay
+        while not stopped():
+            sock = None
+            try:
+                sock = socket.create_connection(self.address, timeout=min(self.timeout, max(left(), 0.01)))
+                self.connects += 1
+                received = time.time()
+                while not stopped():
+                    # short reads, so buffered trades are flushed and `stop` is noticed while the feed is quiet
+                    sock.settimeout(max(min(1, left()), 0.01))
+                    try:
+                        chunk = sock.recv(4096)
+                    except socket.timeout:
+                        if time.time() - received > self.timeout:
+                            raise socket.error('No data for %d seconds' % self.timeout)
+                        if time.time() - self.flushed >= self.flush_seconds:
+                            self.flush()
+                        continue
+                    if not chunk:
+                        raise socket.error('Connection closed')
+                    received, delay = time.time(), self.reconnect_delay
+                    self.feed(chunk)
+            except socket.error, e:
+                warn('Trade feed at %s:%s failed (%s)' % (self.address + (e,)))
+            finally:
+                if sock:
+                    sock.close()
+                self.partial = '' # a line cut off by a lost connection
+                self.flush()
+                for ingester in self.ingesters.values():
+                    ingester.restart()
+            if not stopped():
+                # with jitter, so that many clients don't all reconnect at once
+                wait = min(delay * random.uniform(0.5, 1.5), max(left(), 0))
+                if stop is not None:
+                    stop.wait(wait)
+                else:
+                    time.sleep(wait)
+                delay = min(2 * delay, MAX_RECONNECT_DELAY)
+        return self.stored()
+
+def parse_args():
+    p = ArgumentParser(description='Append the trades streamed by the bitcoincharts telnet interface to a trade store.')
+    p.add_argument(
+        '-p','--path',
+        type    = str,
+        default = 'data/trades',
+        help    = 'Directory of the trade store (see bitcrawl.TRADE_STORE).',
+        )
+    p.add_argument(
+        '-s','--symbols',
+        type    = str,
+        nargs   = '*',
+        default = None,
+        help    = 'Only store the trades of these symbols (e.g. mtgoxUSD).',
+        )
+    p.add_argument(
+        '--host',
+        type    = str,
+        default = FEED_HOST,
+        help    = 'Host of the trade feed.',
+        )
+    p.add_argument(
+        '--port',
+        type    = int,
+        default = FEED_PORT,
+        help    = 'TCP port of the trade feed.',
+        )
+    p.add_argument(
+        '-d','--duration',
+        type    = float,
+        default = None,
+        help    = 'Seconds to run for (forever by default).',
+        )
+    return p.parse_args()
+
+if __name__ == "__main__":
+    o = parse_args()
+    feed = TradeFeed(TradeStore(os.path.expanduser(o.path)), o.host, o.port, symbols=o.symbols)
+    try:
+        feed.run(seconds=o.duration)
+    except KeyboardInterrupt:
+        feed.flush()
+    print ('Stored %d of %d trades received (%d late, %d duplicates, %d invalid lines, %d connections)' %
+           (feed.stored(), feed.received, feed.late(), feed.duplicates(), feed.bad, feed.connects))